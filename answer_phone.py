@@ -1,22 +1,62 @@
 import os
-import json
+import atexit
+import queue
+import asyncio
+import logging
+import logging.handlers
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, Form
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response
 from twilio.twiml.voice_response import VoiceResponse, Gather
 from dotenv import load_dotenv
+import httpx
 import uvicorn
 from langchain_groq import ChatGroq
-from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
+from langchain_core.messages import (
+    HumanMessage, SystemMessage, AIMessage, trim_messages, message_to_dict, messages_from_dict
+)
+from cachetools import TTLCache
+import orjson
+import redis.asyncio as redis
+from redis.exceptions import RedisError
 
-# --- Configuration ---
+# Load .env before anything below reads the environment.
 load_dotenv()
+
+# --- Logging ---
+# Handlers only enqueue records; a background thread does the formatting and writing,
+# so logging never blocks a call on stdout.
+log_queue = queue.SimpleQueue()
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+log_listener = logging.handlers.QueueListener(log_queue, log_handler)
+log_listener.start()
+# Stop at interpreter exit rather than on app shutdown, so records logged after shutdown
+# (or across a second lifespan cycle) are still written instead of silently dropped.
+atexit.register(log_listener.stop)
+# The QueueHandler keeps its default "%(message)s" formatter; the real format is applied once, by the listener.
+root_logger = logging.getLogger()
+root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+root_logger.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+# httpx logs every request at INFO, which would add a line per Groq call on every caller turn.
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
 GROQ_API_KEY = os.getenv('GROQ_API_KEY')
 if not GROQ_API_KEY:
     raise ValueError('Missing the GROQ API key. Please set it in the .env file.')
 
-# In-memory chat history per call session
-# Note: For production, consider using a more persistent store like Redis.
-call_sessions = {}
+# Groq model used for the conversation; override with GROQ_MODEL to try another one.
+GROQ_MODEL = os.getenv('GROQ_MODEL', 'llama-3.3-70b-versatile')
+
+# Chat history per call session, expiring after the caller's last turn.
+# When REDIS_URL is set the history lives in Redis, so any worker can serve any webhook.
+# Otherwise it falls back to an in-memory cache, which only works with a single worker.
+SESSION_TTL_SECONDS = 1800
+REDIS_URL = os.getenv('REDIS_URL')
+redis_client = redis.Redis.from_url(REDIS_URL) if REDIS_URL else None
+call_sessions = TTLCache(maxsize=10_000, ttl=SESSION_TTL_SECONDS)
 
 # System message for the AI wellness coach
 SYSTEM_MESSAGE = """
@@ -37,34 +77,87 @@ Strict Voice Output Rules:
 Important: Your primary role is emotional support. Reinforce positivity and ask gentle, open-ended follow-up questions to keep the conversation going.
 """
 
+# The system prompt never changes, so build the message object once and reuse it on every turn.
+SYSTEM_PROMPT = SystemMessage(content=SYSTEM_MESSAGE)
+
+# Twilio can only start speaking once it has the whole TwiML document, so a runaway reply
+# delays the whole turn. This caps generation well above the "2-3 short sentences" the prompt
+# asks for, so normal replies and their closing follow-up question are never cut off.
+MAX_REPLY_TOKENS = 300
+
+# Per-request LLM timeout, kept under Twilio's 15 second webhook limit.
+LLM_TIMEOUT_SECONDS = 10
+
+# Startup waits for the warm-up, so it is bounded and skipped if Groq is slow to answer.
+WARMUP_TIMEOUT_SECONDS = 5
+
+# Only the most recent messages are sent to the LLM, so prompt size stays flat on long calls.
+HISTORY_WINDOW = 12
+
 # --- Initialize FastAPI and LLM ---
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Warms up the LLM before the first caller is answered.
+    A single tiny request opens the connection to Groq and sends the exact system
+    prompt prefix used on every turn, so the first real turn doesn't pay for either.
+    """
+    if chat_groq:
+        try:
+            await asyncio.wait_for(
+                chat_groq.ainvoke([SYSTEM_PROMPT, HumanMessage(content="Hello")], max_tokens=1),
+                timeout=WARMUP_TIMEOUT_SECONDS
+            )
+        except asyncio.TimeoutError:
+            logger.warning("Timed out warming up Langchain ChatGroq LLM after %s seconds", WARMUP_TIMEOUT_SECONDS)
+        except Exception:
+            logger.exception("Error warming up Langchain ChatGroq LLM")
+    yield
+    await http_client.aclose()
+    if redis_client:
+        await redis_client.aclose()
+
+app = FastAPI(lifespan=lifespan)
+
+# One pooled HTTP client shared by all LLM calls, so turns reuse warm keep-alive connections.
+# The timeout is set on ChatGroq below; the Groq SDK stamps it on every request, overriding any client default.
+http_client = httpx.AsyncClient(
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+)
 
 # Initialize Langchain ChatGroq for the LLM
 try:
     chat_groq = ChatGroq(
         temperature=0.7,
         # Using a model known for strong conversational abilities.
-        model_name="llama3-70b-8192",
-        groq_api_key=GROQ_API_KEY
+        model_name=GROQ_MODEL,
+        groq_api_key=GROQ_API_KEY,
+        max_tokens=MAX_REPLY_TOKENS,
+        request_timeout=LLM_TIMEOUT_SECONDS,
+        http_async_client=http_client
     )
-    print("Langchain ChatGroq LLM initialized successfully.")
-except Exception as e:
-    print(f"Error initializing Langchain ChatGroq LLM: {e}")
+    logger.info("Langchain ChatGroq LLM initialized successfully.")
+except Exception:
+    logger.exception("Error initializing Langchain ChatGroq LLM")
     chat_groq = None
 
 # --- Core Application Logic ---
 
-@app.api_route("/", methods=["GET", "POST"])
-async def index_page():
-    """A simple endpoint to confirm the server is running."""
-    return HTMLResponse("<h1>AI Voice IVR Server is running</h1>")
+def render_error_twiml() -> bytes:
+    """
+    Renders the TwiML played when a request can't be tied to a call.
+    It never varies, so it is rendered once at import rather than on every request.
+    """
+    response = VoiceResponse()
+    response.say("An application error occurred. Please call back later.", voice='Polly.Salli')
+    response.hangup()
+    return str(response).encode()
 
-@app.api_route("/incoming-call", methods=["POST"])
-async def handle_incoming_call():
+def render_incoming_call_twiml() -> bytes:
     """
-    Handles a new incoming call from Twilio.
-    Greets the user and starts the conversation loop with <Gather>.
+    Renders the greeting TwiML that starts every call.
+    Like the error TwiML, it is identical for every caller and rendered once at import.
     """
     response = VoiceResponse()
     
@@ -88,7 +181,23 @@ async def handle_incoming_call():
     response.say("We didn't receive a response. Thank you for calling. Goodbye.", voice='Polly.Salli')
     response.hangup()
     
-    return HTMLResponse(content=str(response), media_type="application/xml")
+    return str(response).encode()
+
+ERROR_TWIML = render_error_twiml()
+INCOMING_CALL_TWIML = render_incoming_call_twiml()
+
+@app.api_route("/", methods=["GET", "POST"])
+async def index_page():
+    """A simple endpoint to confirm the server is running."""
+    return HTMLResponse("<h1>AI Voice IVR Server is running</h1>")
+
+@app.api_route("/incoming-call", methods=["POST"])
+async def handle_incoming_call():
+    """
+    Handles a new incoming call from Twilio.
+    Greets the user and starts the conversation loop with <Gather>.
+    """
+    return Response(content=INCOMING_CALL_TWIML, media_type="application/xml")
 
 @app.api_route("/handle-speech", methods=["POST"])
 async def handle_speech(request: Request):
@@ -101,16 +210,10 @@ async def handle_speech(request: Request):
     call_sid = form.get("CallSid")
     user_speech = form.get("SpeechResult", "").strip()
     
-    response = VoiceResponse()
-
     if not call_sid:
-        response.say("An application error occurred. Please call back later.", voice='Polly.Salli')
-        response.hangup()
-        return HTMLResponse(content=str(response), media_type="application/xml")
+        return Response(content=ERROR_TWIML, media_type="application/xml")
 
-    # Initialize session if it's a new call
-    if call_sid not in call_sessions:
-        call_sessions[call_sid] = {'history': []}
+    response = VoiceResponse()
 
     # Start the next <Gather> to continue the conversation loop.
     gather = response.gather(
@@ -123,21 +226,22 @@ async def handle_speech(request: Request):
 
     # If the user said something, process it and say the response.
     if user_speech:
-        print(f"[{call_sid}] User said: {user_speech}")
+        logger.debug("[%s] User said: %s", call_sid, user_speech)
         
-        call_sessions[call_sid]['history'].append(HumanMessage(content=user_speech))
+        user_message = HumanMessage(content=user_speech)
+        history = await load_history(call_sid)
         
-        llm_response_text = await generate_llm_response(call_sid)
-        print(f"[{call_sid}] AI said: {llm_response_text}")
+        llm_response_text = await generate_llm_response(call_sid, history + [user_message])
+        logger.debug("[%s] AI said: %s", call_sid, llm_response_text)
 
-        call_sessions[call_sid]['history'].append(AIMessage(content=llm_response_text))
+        await append_history(call_sid, user_message, AIMessage(content=llm_response_text))
         
         # Nest the AI's response inside the new <Gather> as its prompt.
         gather.say(llm_response_text, voice='Polly.Salli')
     
     else:
         # If no speech was detected from the previous <Gather>, prompt the user again.
-        print(f"[{call_sid}] No speech detected.")
+        logger.debug("[%s] No speech detected.", call_sid)
         # Nest the re-prompt inside the new <Gather>.
         gather.say("I'm sorry, I didn't hear anything. Could you please say that again?", voice='Polly.Salli')
 
@@ -145,10 +249,50 @@ async def handle_speech(request: Request):
     response.say("It seems we've been disconnected. Thank you for calling. Goodbye.", voice='Polly.Salli')
     response.hangup()
 
-    return HTMLResponse(content=str(response), media_type="application/xml")
+    return Response(content=str(response), media_type="application/xml")
+
+
+async def load_history(call_id: str) -> list:
+    """
+    Returns the stored conversation history for a call, oldest message first.
+    If Redis is unreachable the turn carries on with an empty history rather than failing the call.
+    """
+    if redis_client:
+        try:
+            items = await redis_client.lrange(f"sess:{call_id}", 0, -1)
+        except (RedisError, OSError):
+            logger.exception("Error loading history for call %s", call_id)
+            return []
+        return messages_from_dict([orjson.loads(item) for item in items])
+    return list(call_sessions.get(call_id, {'history': []})['history'])
+
+
+async def append_history(call_id: str, *messages) -> None:
+    """
+    Appends messages to a call's history and refreshes the session expiry.
+    Only the last HISTORY_WINDOW messages are kept, since older ones are never sent to the LLM.
+    If Redis is unreachable the error is logged and the turn's reply is still returned to the caller.
+    """
+    if redis_client:
+        key = f"sess:{call_id}"
+        try:
+            # One round-trip for the append, the trim and the expiry refresh.
+            async with redis_client.pipeline(transaction=True) as pipe:
+                pipe.rpush(key, *(orjson.dumps(message_to_dict(message)) for message in messages))
+                pipe.ltrim(key, -HISTORY_WINDOW, -1)
+                pipe.expire(key, SESSION_TTL_SECONDS)
+                await pipe.execute()
+        except (RedisError, OSError):
+            logger.exception("Error saving history for call %s", call_id)
+        return
+    
+    session = call_sessions.get(call_id, {'history': []})
+    session['history'] = (session['history'] + list(messages))[-HISTORY_WINDOW:]
+    # Storing the session again also refreshes its expiry.
+    call_sessions[call_id] = session
 
 
-async def generate_llm_response(call_id: str) -> str:
+async def generate_llm_response(call_id: str, history: list) -> str:
     """
     Generates a response using the Groq LLM based on conversation history.
     """
@@ -157,21 +301,27 @@ async def generate_llm_response(call_id: str) -> str:
         
     try:
         # Prepare messages with system prompt and history
-        messages = [SystemMessage(content=SYSTEM_MESSAGE)]
+        messages = [SYSTEM_PROMPT]
         
-        # Add the conversation history for context
-        if call_id in call_sessions:
-            messages.extend(call_sessions[call_id]['history'])
+        # Add the recent conversation history for context
+        messages.extend(trim_messages(
+            history,
+            max_tokens=HISTORY_WINDOW,
+            token_counter=len,
+            strategy="last",
+            start_on="human"
+        ))
         
         # Generate response
         response = await chat_groq.ainvoke(messages)
         return response.content
         
-    except Exception as e:
-        print(f"Error generating LLM response for call {call_id}: {e}")
+    except Exception:
+        logger.exception("Error generating LLM response for call %s", call_id)
         return "I'm sorry, I'm having a little trouble understanding. Could you please say that again?"
 
 # --- Run the Application ---
 if __name__ == "__main__":
     # Use this for local development. For production, use a Gunicorn or other ASGI server.
+    # uvicorn picks up uvloop and httptools from uvicorn[standard] automatically where they are available.
     uvicorn.run(app, host="0.0.0.0", port=8000)
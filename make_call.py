@@ -1,24 +1,40 @@
 from dotenv import load_dotenv
+from functools import lru_cache
 import os
 from twilio.rest import Client
 
 # 1. Load .env file (make sure this is at top)
 load_dotenv()
 
-# 2. Get Account SID and Auth Token using correct syntax
-account_sid = os.getenv("TWILIO_ACCOUNT_SID")
-auth_token = os.getenv("TWILIO_AUTH_TOKEN")
 
-# 3. Validate that both are present
-if not account_sid or not auth_token:
-    raise EnvironmentError("Missing TWILIO_ACCOUNT_SID or TWILIO_AUTH_TOKEN in environment.")
+@lru_cache(maxsize=1)
+def get_client() -> Client:
+    """
+    Returns the shared Twilio client, creating it on first use.
+    Reusing one client keeps its pooled HTTP session alive, so later calls skip the TLS handshake.
+    """
+    # 2. Get Account SID and Auth Token using correct syntax
+    account_sid = os.getenv("TWILIO_ACCOUNT_SID")
+    auth_token = os.getenv("TWILIO_AUTH_TOKEN")
 
-client = Client(account_sid, auth_token)
+    # 3. Validate that both are present
+    if not account_sid or not auth_token:
+        raise EnvironmentError("Missing TWILIO_ACCOUNT_SID or TWILIO_AUTH_TOKEN in environment.")
 
-call = client.calls.create(
-    to="+918799472801",
-    from_="+19122145317",
-    url="https://a88649219bc4.ngrok-free.app/incoming-call"
-)
+    return Client(account_sid, auth_token)
 
-print(call.sid)
+
+def make_call(to: str, from_: str, url: str) -> str:
+    """
+    Places an outbound call that fetches its TwiML from `url` and returns the call SID.
+    """
+    call = get_client().calls.create(to=to, from_=from_, url=url)
+    return call.sid
+
+
+if __name__ == "__main__":
+    print(make_call(
+        to="+918799472801",
+        from_="+19122145317",
+        url="https://a88649219bc4.ngrok-free.app/incoming-call"
+    ))
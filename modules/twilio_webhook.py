@@ -2,10 +2,13 @@ from fastapi import APIRouter, Request, Response
 
 router = APIRouter()
 
+# The placeholder TwiML never changes, so it is encoded once instead of on every webhook hit.
+_STATIC_TWIML = b"<Response><Say>Processing your request</Say></Response>"
+
 @router.post("/voice")
 async def handle_twilio_voice(request: Request):
     # Parse Twilio webhook payload
     # Extract audio or recording URL from request
     # Call speech-to-text module (to be implemented)
     # Return TwiML or appropriate response
-    return Response(content="<Response><Say>Processing your request</Say></Response>", media_type="application/xml") 
\ No newline at end of file
+    return Response(content=_STATIC_TWIML, media_type="application/xml") 
\ No newline at end of file